@@ -1,59 +1,96 @@
 import streamlit as st
 import pandas as pd
+import hashlib
+import io
 import json
-
-def get_value_from_path(data, path):
-    """Extract value from nested JSON using dot notation path"""
-    try:
-        # Split the path into parts
-        parts = path.split('.')
-        current = data
-        
-        # Handle the special case where first element is 'data'
-        if parts[0] == 'data':
-            current = current['data'][0]  # Get first item from data array
-            parts = parts[1:]  # Remove 'data' from parts
-            
-        # Navigate through the path
-        for part in parts:
-            current = current[part]
-        return current
-    except (KeyError, IndexError, TypeError):
-        return None
+import numpy as np
+from upload_page import UPLOAD_CACHE_ENTRIES, UPLOAD_CACHE_TTL, flatten_columnar, get_json_data
 
 def get_nested_value(obj, path_parts):
     """
     Safely navigate nested structures (both dicts and lists) and return all
-    matched items if a path leads into a list of objects. 
+    matched items if a path leads into a list of objects. `path_parts` can be
+    any iterable of keys, e.g. a tuple precomputed once per path.
     """
+    path_parts = tuple(path_parts)
+    _type = type  # Local binding for the hot loop
+
+    # Fast path: plain dotted access while every intermediate is a dict.
+    # Parsed JSON only holds plain dicts and lists, so exact type checks suffice.
+    current = obj
+    for i, part in enumerate(path_parts):
+        if _type(current) is dict:
+            current = current.get(part)
+            if current is None:
+                return None
+            if _type(current) is list:
+                # Lists need the breadth expansion for the remaining parts
+                return _list_walk(current, path_parts[i + 1:])
+        elif _type(current) is list:
+            return _list_walk([current], path_parts[i:])
+        else:
+            return None
+    return current
+
+def _list_walk(current, path_parts):
+    """Expand lists breadth-first while following the remaining path parts."""
     # We'll collect intermediate matches as a list so we can gather multiple values
-    current = [obj]
+    _type = type  # Local binding for the hot loop
+    current = list(current)
     for part in path_parts:
         next_values = []
         for element in current:
-            if isinstance(element, dict):
+            element_type = _type(element)
+            if element_type is dict:
                 # If dict, try to get the child by key.
                 val = element.get(part, None)
                 if val is not None:
                     # If val is a list, expand it into next_values; else just append
-                    if isinstance(val, list):
+                    if _type(val) is list:
                         next_values.extend(val)
                     else:
                         next_values.append(val)
-            elif isinstance(element, list):
+            elif element_type is list:
                 # If we already have a list, flatten it so we can keep looking
-                next_values.extend(element if isinstance(element, list) else [])
+                next_values.extend(element)
             # If something is None or not dict/list, we skip it
         current = next_values
         # If we have an empty list here, no need to keep going
         if not current:
             return None
-    
+
+    if not current:
+        return None
     # If at the end we only have one item in current, return it directly
     if len(current) == 1:
         return current[0]
     return current
 
+def compile_path(path_parts):
+    """
+    Compile path parts into an accessor equivalent to get_nested_value(obj, path_parts).
+    Plain dict chains are read with one generated subscript expression; paths that
+    reach a list or a non-dict intermediate fall back to get_nested_value.
+    """
+    path_parts = tuple(path_parts)
+    # repr() turns every key into a safe string literal
+    subscripts = "".join(f"[{part!r}]" for part in path_parts)
+    source = (
+        "def accessor(obj):\n"
+        "    try:\n"
+        f"        value = obj{subscripts}\n"
+        "    except KeyError:\n"
+        "        return None\n"
+        "    except TypeError:\n"
+        "        return get_nested_value(obj, path_parts)\n"
+        "    if type(value) is list:\n"
+        "        return get_nested_value(obj, path_parts)\n"
+        "    return value\n"
+    )
+    namespace = {"get_nested_value": get_nested_value, "path_parts": path_parts}
+    exec(source, namespace)
+    return namespace["accessor"]
+
 def filter_redundant_paths(selected_paths):
     """
     Given a list of path_info dicts like:
@@ -67,76 +104,168 @@ def filter_redundant_paths(selected_paths):
     sp_list.sort(key=lambda x: len(x[1]))
 
     final_paths = []
+    accepted = set()
     for text_i, path_i in sp_list:
-        # Check if path_i has a parent in final_paths
+        # path_i is a child if any of its proper dotted prefixes was accepted
+        parts = path_i.split(".")
+        prefix = parts[0]
         is_child = False
-        for text_j, path_j in final_paths:
-            if path_i.startswith(path_j + "."):
-                # path_j is a parent of path_i
+        for part in parts[1:]:
+            if prefix in accepted:
                 is_child = True
                 break
+            prefix = f"{prefix}.{part}"
         if not is_child:
+            accepted.add(path_i)
             final_paths.append((text_i, path_i))
 
     # Convert back to the original "text/path" dict format
     return [{"text": t, "path": p} for t, p in final_paths]
 
-def create_dataframe_from_json(json_data, selected_paths):
+def create_dataframe_from_json(json_data, selected_paths, json_hash=None):
     """Create a DataFrame from JSON data using selected paths"""
     if isinstance(selected_paths, str):
         selected_paths = json.loads(selected_paths)
 
+    # Key the cache on the upload's content hash (or the serialized data) and the
+    # selection so reruns reuse the built DataFrame
+    if json_hash is None:
+        json_hash = hashlib.sha256(json.dumps(json_data).encode()).hexdigest()
+    return _build_df(json_hash, json.dumps(selected_paths, sort_keys=True), json_data)
+
+@st.cache_data(show_spinner=False, max_entries=UPLOAD_CACHE_ENTRIES, ttl=UPLOAD_CACHE_TTL)
+def _build_df(json_hash: str, paths_json: str, _json_data) -> pd.DataFrame:
+    """Build the DataFrame for a JSON payload (identified by its hash) and path selection"""
+    selected_paths = json.loads(paths_json)
+
     # Filter selections to avoid duplicates while maintaining order
     filtered_paths = filter_redundant_paths(selected_paths)
+
+    # Split each path once up front instead of once per record
+    plan = []
+    for path_info in filtered_paths:
+        path_parts = path_info['path'].split('.')
+        if path_parts and path_parts[0] == 'data':
+            path_parts = path_parts[1:]  # Remove 'data' prefix
+        plan.append((path_info['text'], tuple(path_parts)))
     
-    records = []
-    for item in json_data['data']:
-        record = {}
-        # Use OrderedDict or maintain order in regular dict (Python 3.7+)
-        for path_info in filtered_paths:
-            column_name = path_info['text']
-            
-            path_parts = path_info['path'].split('.')
-            if path_parts and path_parts[0] == 'data':
-                path_parts = path_parts[1:]  # Remove 'data' prefix
-                
-            value = get_nested_value(item, path_parts)
-            record[column_name] = value
-        records.append(record)
-    
-    # Create DataFrame with explicit column order
-    df = pd.DataFrame(records)
-    
-    # Reorder columns to match the order in filtered_paths
-    ordered_columns = [path_info['text'] for path_info in filtered_paths]
-    df = df[ordered_columns]
-    
-    return df
+    records = _json_data['data']
+
+    # Read columns from the upload's columnar store (built once per upload)
+    # instead of walking every record for every selection
+    stored_columns, list_rows = flatten_columnar(json_hash, _json_data)
+
+    # Fill one preallocated object array per column instead of building a dict per record
+    columns = {}
+    for column_name, path_parts in plan:
+        accessor = compile_path(path_parts)
+        stored = stored_columns.get(path_parts)
+        if path_parts and stored is not None:
+            column = stored.copy()
+            # Rows where the path or one of its ancestors holds a list need
+            # get_nested_value's list handling
+            for depth in range(len(path_parts) + 1):
+                for i in list_rows.get(path_parts[:depth], ()):
+                    column[i] = accessor(records[i])
+        else:
+            # Paths below lists or selecting whole records need the slow walker
+            column = np.empty(len(records), dtype=object)
+            _fill_by_walking(column, records, accessor)
+        columns[column_name] = column
+
+    # Create DataFrame with explicit column order matching filtered_paths,
+    # taking the column arrays by reference
+    return pd.DataFrame(columns, columns=[column_name for column_name, _ in plan], copy=False)
+
+def _fill_by_walking(column, records, accessor):
+    """Fill column with the compiled path accessor for every record."""
+    for i, item in enumerate(records):
+        column[i] = accessor(item)
 
 def format_value(value):
     """Format a single value for display."""
-    if isinstance(value, dict):
-        formatted_lines = []
-        for k, v in value.items():
-            if isinstance(v, (dict, list)):
-                formatted_lines.append(f"{k}:")
-                formatted_lines.extend("    " + line for line in format_value(v).split("\n"))
-            else:
-                formatted_lines.append(f"{k}:{v}")
-        return "\n".join(formatted_lines)
-    elif isinstance(value, list):
-        # For list of dictionaries, format each item
-        if value and isinstance(value[0], dict):
-            formatted_items = []
-            for item in value:
-                item_lines = []
-                for k, v in item.items():
-                    item_lines.append(f'"{k}" : {json.dumps(v, ensure_ascii=False)}')
-                formatted_items.append("\n".join(item_lines))
-            return "\n\n".join(formatted_items)
+    buf = io.StringIO()
+    _write_value(buf, value, "")
+    return buf.getvalue()
+
+def _write_text(buf, text, indent):
+    """Write text to buf with every line prefixed by indent."""
+    buf.write(indent)
+    buf.write(text.replace("\n", "\n" + indent) if indent else text)
+
+def _write_value(buf, value, indent):
+    """Write the formatted value to a shared buffer, nesting by indent."""
+    _WRITERS.get(type(value), _write_scalar)(buf, value, indent)
+
+def _write_dict(buf, value, indent):
+    """Write a dict as key:value lines, nesting containers one level deeper."""
+    if not value:
+        buf.write(indent)
+    for i, (k, v) in enumerate(value.items()):
+        if i:
+            buf.write("\n")
+        if type(v) in _WRITERS:
+            _write_text(buf, f"{k}:", indent)
+            buf.write("\n")
+            _write_value(buf, v, indent + "    ")
         else:
-            return ", ".join(map(str, value))
-    return str(value)
+            _write_text(buf, f"{k}:{v}", indent)
+
+def _write_list(buf, value, indent):
+    """Write a list of dicts item by item, or any other list comma-separated."""
+    # For list of dictionaries, format each item
+    if value and type(value[0]) is dict:
+        for i, item in enumerate(value):
+            if i:
+                # Blank line between items
+                buf.write("\n")
+                buf.write(indent)
+                buf.write("\n")
+            if not item:
+                buf.write(indent)
+            for j, (k, v) in enumerate(item.items()):
+                if j:
+                    buf.write("\n")
+                _write_text(buf, f'"{k}" : {json.dumps(v, ensure_ascii=False)}', indent)
+    else:
+        _write_text(buf, ", ".join(map(str, value)), indent)
+
+def _write_scalar(buf, value, indent):
+    """Write any non-container value via str()."""
+    _write_text(buf, str(value), indent)
+
+# Exact-type dispatch: parsed JSON only holds plain dicts and lists
+_WRITERS = {dict: _write_dict, list: _write_list}
+
+@st.cache_data(show_spinner=False, max_entries=50)  # Enough for prev/next navigation
+def _format_record(record_json: str) -> str:
+    """Format a JSON-serialized record for display, cached on its content."""
+    return format_value(json.loads(record_json))
+
+def get_labeled_dataset():
+    """Return the dataset with the collected responses attached as columns."""
+    dataset = st.session_state.get("dataset")
+    responses = st.session_state.get("responses")
+    if dataset is None or not responses:
+        return dataset
+    # Object dtype keeps ratings as ints alongside unanswered (None) rows
+    return dataset.assign(**{
+        question_title: pd.Series(values, index=dataset.index, dtype="object")
+        for question_title, values in responses.items()
+    })
+
+def _prev_record():
+    """Step back one record, staying at the first."""
+    if st.session_state.current_index > 0:
+        st.session_state.current_index -= 1
+        st.session_state.form_submitted = False
+
+def _next_record():
+    """Step forward one record, staying at the last."""
+    dataset = st.session_state.get("dataset")
+    if dataset is not None and st.session_state.current_index < len(dataset) - 1:
+        st.session_state.current_index += 1
+        st.session_state.form_submitted = False
 
 def display_labeling_page():
     st.set_page_config(layout="wide")
@@ -150,12 +279,23 @@ def display_labeling_page():
         st.session_state.labeling_complete = False
     
     # Get the JSON data and selected columns from session state
-    json_data = st.session_state.get("json_data")  # Make sure to store the original JSON data
+    json_data = get_json_data()  # Shared from the upload page's resource cache
     selected_columns = st.session_state.get("selected_columns", [])
 
     # Create DataFrame if not already created
     if "dataset" not in st.session_state and json_data and selected_columns:
-        st.session_state.dataset = create_dataframe_from_json(json_data, selected_columns)
+        st.session_state.dataset = create_dataframe_from_json(
+            json_data, selected_columns, st.session_state.json_hash
+        )
+
+    # Keep responses as one preallocated list per question; they're only
+    # attached to the dataset when it's saved or uploaded
+    if "responses" not in st.session_state:
+        st.session_state.responses = {}
+    if "dataset" in st.session_state:
+        for question in st.session_state.get("questions", []):
+            if question['question_title'] not in st.session_state.responses:
+                st.session_state.responses[question['question_title']] = [None] * len(st.session_state.dataset)
     
 
     col1, col2 = st.columns([2, 1])
@@ -166,17 +306,12 @@ def display_labeling_page():
         
         # Navigation buttons in a row
         col1_nav, col2_nav = st.columns([1, 1])
+        # Callbacks run before the click's rerun, so no second st.rerun() is needed
         with col1_nav:
-            if st.button("⬅️ Previous", key="prev_btn") and st.session_state.current_index > 0:
-                st.session_state.current_index -= 1
-                st.session_state.form_submitted = False
-                st.rerun()
+            st.button("⬅️ Previous", key="prev_btn", on_click=_prev_record)
 
         with col2_nav:
-            if st.button("Next ➡️", key="next_btn") and st.session_state.current_index < len(dataset) - 1:
-                st.session_state.current_index += 1
-                st.session_state.form_submitted = False
-                st.rerun()
+            st.button("Next ➡️", key="next_btn", on_click=_next_record)
 
         if dataset is not None and not dataset.empty:
             st.markdown("#### Dataset Records")
@@ -199,8 +334,10 @@ def display_labeling_page():
                 for col in data_columns:
                     record_dict[col] = record[col]
                 
-                # Display the chosen columns recursively with our format_value function
-                st.code(format_value(record_dict), language="json")
+                # Display the chosen columns recursively with our format_value function,
+                # cached on the record's content so non-navigation reruns skip formatting
+                record_json = json.dumps(record_dict, ensure_ascii=False, default=str)
+                st.code(_format_record(record_json), language="json")
 
     # Right column: Questions form
     with col2:
@@ -228,14 +365,14 @@ def display_labeling_page():
                         user_responses[question['question_title']] = response
 
                     elif question['question_type'] == "Multi-label":
-                        selected_labels = []
-                        for label in question['labels']:
-                            if st.checkbox(
-                                label, 
-                                key=f"multi_label_{label}_{st.session_state.current_index}",
-                                value=False  # Reset to unchecked
-                            ):
-                                selected_labels.append(label)
+                        # One multiselect instead of a checkbox per label
+                        chosen = st.multiselect(
+                            f"{question['label_description']}",
+                            question['labels'],
+                            key=f"multi_label_{idx}_{st.session_state.current_index}"
+                        )
+                        # Keep the labels' own order regardless of click order
+                        selected_labels = [label for label in question['labels'] if label in chosen]
                         user_responses[question['question_title']] = ", ".join(selected_labels)
 
                     elif question['question_type'] == "Rating":
@@ -251,11 +388,9 @@ def display_labeling_page():
                 submit_button = st.form_submit_button("Submit")
                 
                 if submit_button:
-                    # Save responses to dataset
+                    # Save responses for the current record
                     for question_title, response in user_responses.items():
-                        st.session_state.dataset.loc[
-                            st.session_state.current_index, question_title
-                        ] = response
+                        st.session_state.responses[question_title][st.session_state.current_index] = response
 
                     # Mark form as submitted
                     st.session_state.form_submitted = True
@@ -279,7 +414,7 @@ def display_labeling_page():
     # Save labeled data as CSV
     if st.session_state.get("labeling_complete"):
         if st.button("Save labeled data"):
-            labeled_df = pd.DataFrame(st.session_state.dataset)
+            labeled_df = get_labeled_dataset()
             labeled_df.to_csv("labeled_data.csv", index=False)
             st.success("Labeled data saved as 'labeled_data.csv'!")
             st.rerun()
@@ -1,5 +1,6 @@
 import streamlit as st
 from labeling_page import create_dataframe_from_json
+from upload_page import get_json_data
 
 @st.fragment
 def display_question_page():
@@ -22,12 +23,18 @@ def display_question_page():
         st.session_state.labels_input_key = "labels_input_0"
     
     # Get the JSON data and selected columns from session state
-    json_data = st.session_state.get("json_data")  # Make sure to store the original JSON data
+    json_data = get_json_data()  # Shared from the upload page's resource cache
     selected_columns = st.session_state.get("selected_columns", [])
 
     # Create DataFrame if not already created
     if "dataset" not in st.session_state and json_data and selected_columns:
-        st.session_state.dataset = create_dataframe_from_json(json_data, selected_columns)
+        st.session_state.dataset = create_dataframe_from_json(
+            json_data, selected_columns, st.session_state.json_hash
+        )
+
+    if "dataset" not in st.session_state:
+        st.warning("No dataset found. Please upload a valid file and select fields first.")
+        return
 
     st.markdown("### Dataset Preview:")
     st.write(st.session_state.dataset.head(5))
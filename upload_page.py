@@ -1,97 +1,109 @@
 import streamlit as st
+import hashlib
+import io
 import json
+import ijson
+import numpy as np
 import pandas as pd
-from typing import Dict, List, Union, Any
+from typing import Dict, List, Optional, Union, Any
 from collections import defaultdict
+from itertools import islice
 
-def get_path_value(data: Union[Dict, List], path: str) -> Any:
-    """Get value from nested structure using dot notation path."""
-    try:
-        current = data
-        parts = path.split('.')
-        
-        # Special handling for 'data' at the root
-        if parts[0] == 'data' and isinstance(current.get('data'), list):
-            current = current['data']
-            # For preview, just show first item
-            if len(parts) > 1 and current:
-                current = current[0]
-            parts = parts[1:]
-        
-        # Navigate through the path
-        for part in parts:
-            if isinstance(current, dict):
-                current = current.get(part)
-            elif isinstance(current, list):
-                # If we're looking at a list, we want to:
-                # 1. Show all values for actual data processing
-                # 2. Show first value for preview
-                preview_mode = True  # Set this based on context
-                if preview_mode and current:
-                    current = current[0].get(part) if isinstance(current[0], dict) else None
-                else:
-                    return [item.get(part) if isinstance(item, dict) else None for item in current]
-            else:
-                return None
-                
-        return current
-    except (KeyError, IndexError, AttributeError):
-        return None
+try:
+    import orjson
+except ImportError:  # orjson is optional; the stdlib parser is used without it
+    orjson = None
+
+def flatten_json(data: Union[Dict, List], parent_key: str = '', sep: str = '.',
+                 samples: Optional[Dict[str, Any]] = None) -> List[str]:
+    """Flatten a nested JSON structure and return paths to all leaf nodes.
 
-def flatten_json(data: Union[Dict, List], parent_key: str = '', sep: str = '.') -> List[str]:
-    """Flatten a nested JSON structure and return paths to all leaf nodes."""
+    If a `samples` dict is given, it is filled with the first value seen for each path.
+    """
     paths = []
-    
-    if isinstance(data, dict):
-        for key, value in data.items():
-            new_key = f"{parent_key}{sep}{key}" if parent_key else key
-            if isinstance(value, (dict, list)):
-                if not value:  # Handle empty dict/list
-                    paths.append(new_key)
-                else:
-                    paths.extend(flatten_json(value, new_key, sep))
+    seen = set()  # Remove duplicates while preserving order
+
+    # Walk with an explicit stack of (is_leaf, node, key) frames instead of recursing.
+    # Children are pushed in reverse so paths come out in document order.
+    stack = [(False, data, parent_key)]
+    while stack:
+        is_leaf, node, key = stack.pop()
+        if is_leaf:
+            if key not in seen:
+                seen.add(key)
+                paths.append(key)
+                if samples is not None:
+                    samples[key] = node
+            continue
+
+        frames = []
+        if isinstance(node, dict):
+            for child_key, value in node.items():
+                new_key = f"{key}{sep}{child_key}" if key else child_key
+                # Empty dicts/lists are leaves as well
+                frames.append((not (isinstance(value, (dict, list)) and value), value, new_key))
+
+        elif isinstance(node, list):
+            if not node:  # Handle empty list
+                frames.append((True, node, key))
             else:
-                paths.append(new_key)
-                
-    elif isinstance(data, list):
-        if not data:  # Handle empty list
-            paths.append(parent_key)
+                # Check all items in list to find all possible paths. Only the first
+                # item with a given key is walked, so later items just add new keys.
+                seen_keys = set()
+                for item in islice(node, 10):  # Limit to first 10 items for performance
+                    if isinstance(item, dict):
+                        if seen_keys.issuperset(item):
+                            continue  # Same schema as the items before it
+                        for child_key, value in item.items():
+                            if child_key not in seen_keys:
+                                seen_keys.add(child_key)
+                                new_key = f"{key}{sep}{child_key}" if key else child_key
+                                frames.append((not isinstance(value, (dict, list)), value, new_key))
+                    elif isinstance(item, list):
+                        frames.append((False, item, key))
+                    else:
+                        frames.append((True, node, key))
+                        break
         else:
-            # Check all items in list to find all possible paths
-            seen_paths = set()
-            for item in data[:10]:  # Limit to first 10 items for performance
-                if isinstance(item, dict):
-                    for key, value in item.items():
-                        new_key = f"{parent_key}{sep}{key}" if parent_key else key
-                        if new_key not in seen_paths:
-                            seen_paths.add(new_key)
-                            if isinstance(value, (dict, list)):
-                                paths.extend(flatten_json(value, new_key, sep))
-                            else:
-                                paths.append(new_key)
-                elif isinstance(item, list):
-                    paths.extend(flatten_json(item, parent_key, sep))
-                else:
-                    paths.append(parent_key)
-                    break
-    else:
-        paths.append(parent_key)
-    
-    return list(dict.fromkeys(paths))  # Remove duplicates while preserving order
+            frames.append((True, node, key))
+
+        stack.extend(reversed(frames))
+
+    return paths
 
 def organize_paths(paths: List[str], json_data: Any) -> Dict[str, Any]:
     """Organize paths into a proper hierarchical structure for display while maintaining order."""
+    sep = '.'
+    leaf_paths = set(paths)
+    branch_paths = set()
+    for path in paths:
+        end = path.find(sep)
+        while end != -1:
+            branch_paths.add(path[:end])
+            end = path.find(sep, end + 1)
+
+    # Lay the tree out in one walk over the JSON so keys come in their original
+    # order. Lists of objects take their key order from the first item, so when
+    # records differ in schema, siblings follow the first record's key order.
     tree = {}
-    
-    # Helper function to get the original order of keys at each level
-    def get_ordered_keys(data: Union[Dict, List], prefix: str = "") -> List[str]:
-        if isinstance(data, dict):
-            return [f"{prefix}{k}" if prefix else k for k in data.keys()]
-        elif isinstance(data, list) and len(data) > 0 and isinstance(data[0], dict):
-            return [f"{prefix}{k}" if prefix else k for k in data[0].keys()]
-        return []
-
-    # Build initial tree structure
+    stack = [(json_data, None, tree)]
+    while stack:
+        node, prefix, subtree = stack.pop()
+        while isinstance(node, list):
+            node = node[0] if node else None
+        if not isinstance(node, dict):
+            continue
+        for key, child in node.items():
+            if sep in key:
+                continue  # Dotted keys are split into separate levels below
+            path = key if prefix is None else f"{prefix}{sep}{key}"
+            if path in branch_paths:
+                subtree[key] = {}
+                stack.append((child, path, subtree[key]))
+            elif path in leaf_paths:
+                subtree[key] = None
+
+    # Then add any remaining paths that the walk didn't reach
     for path in paths:
         parts = path.split('.')
         current = tree
@@ -104,147 +116,142 @@ def organize_paths(paths: List[str], json_data: Any) -> Dict[str, Any]:
                 if part not in current:
                     current[part] = None
 
-    # Function to sort dictionary keys based on original JSON order
-    def sort_dict_by_json_order(d: Dict[str, Any], prefix: str = "") -> Dict[str, Any]:
-        if not isinstance(d, dict):
-            return d
-
-        # Get ordered keys for this level
-        ordered_keys = get_ordered_keys(json_data, prefix)
-        
-        # Create new ordered dictionary
-        ordered_dict = {}
-        
-        # First add keys that exist in original order
-        for key in ordered_keys:
-            key_without_prefix = key[len(prefix):] if prefix else key
-            if key_without_prefix in d:
-                ordered_dict[key_without_prefix] = sort_dict_by_json_order(
-                    d[key_without_prefix], 
-                    f"{prefix}{key_without_prefix}." if prefix else f"{key_without_prefix}."
-                )
-        
-        # Then add any remaining keys that might not be in the original JSON
-        for key in d:
-            if key not in ordered_dict:
-                ordered_dict[key] = sort_dict_by_json_order(
-                    d[key],
-                    f"{prefix}{key}." if prefix else f"{key}."
-                )
-        
-        return ordered_dict
-
-    # Sort the tree based on original JSON order
-    return sort_dict_by_json_order(tree)
-
-def render_tree(tree: Dict[str, Any], json_data: Any, parent_path: str = "", level: int = 0) -> dict:
-    """Recursively render the tree structure."""
-    selected_paths = {
-        "fields": [],
-        "metadata": []
-    }
-    
+    return tree
+
+def _leaf_paths(tree: Dict[str, Any], parent_path: str = ""):
+    """Yield the leaf paths of the tree in display order."""
     for key, subtree in tree.items():
         current_path = f"{parent_path}.{key}" if parent_path else key
-        indent = "&nbsp;" * (level * 4)
-        
-        if subtree is None:  # Leaf node
-            value = get_path_value(json_data, current_path)
-            
-            col1, col2, col3 = st.columns([2, 0.5, 1])
-            
-            with col1:
-                # Remove the sample display, just show the key
-                st.markdown(f"{indent}📄 {key}", unsafe_allow_html=True)
-            
-            with col2:
-                is_selected = st.checkbox(
-                    "Select",
-                    key=f"select_{current_path}",
-                    value=current_path in (st.session_state.temp_selected_paths | st.session_state.temp_metadata_paths)
-                )
-            
-            with col3:
-                if is_selected:
-                    field_type = st.radio(
-                        "Type",
-                        options=["Display", "Metadata"],
-                        key=f"type_{current_path}",
-                        horizontal=True,
-                        index=1 if current_path in st.session_state.temp_metadata_paths else 0,
-                        label_visibility="collapsed"
-                    )
-                    
-                    # Update selected paths while maintaining order
-                    if field_type == "Display":
-                        if current_path not in selected_paths["fields"]:
-                            selected_paths["fields"].append(current_path)
-                        if current_path in selected_paths["metadata"]:
-                            selected_paths["metadata"].remove(current_path)
-                        st.session_state.temp_selected_paths.add(current_path)
-                        st.session_state.temp_metadata_paths.discard(current_path)
-                    else:
-                        if current_path not in selected_paths["metadata"]:
-                            selected_paths["metadata"].append(current_path)
-                        if current_path in selected_paths["fields"]:
-                            selected_paths["fields"].remove(current_path)
-                        st.session_state.temp_metadata_paths.add(current_path)
-                        st.session_state.temp_selected_paths.discard(current_path)
-                else:
-                    # Clear selections if unchecked
-                    if current_path in selected_paths["fields"]:
-                        selected_paths["fields"].remove(current_path)
-                    if current_path in selected_paths["metadata"]:
-                        selected_paths["metadata"].remove(current_path)
-                    st.session_state.temp_selected_paths.discard(current_path)
-                    st.session_state.temp_metadata_paths.discard(current_path)
-
-        else:  # Branch node
-            toggle_key = f"toggle_{current_path}"
-            if toggle_key not in st.session_state.tree_toggles:
-                st.session_state.tree_toggles[toggle_key] = True
-                
-            col1, col2 = st.columns([0.1, 0.9])
-            with col1:
-                if st.button("📁" if st.session_state.tree_toggles[toggle_key] else "📂", key=f"btn_{toggle_key}"):
-                    st.session_state.tree_toggles[toggle_key] = not st.session_state.tree_toggles[toggle_key]
-            with col2:
-                st.markdown(f"{indent}**{key}**", unsafe_allow_html=True)
-            
-            if st.session_state.tree_toggles[toggle_key]:
-                child_paths = render_tree(subtree, json_data, current_path, level + 1)
-                # Extend lists instead of updating sets
-                for path in child_paths["fields"]:
-                    if path not in selected_paths["fields"]:
-                        selected_paths["fields"].append(path)
-                for path in child_paths["metadata"]:
-                    if path not in selected_paths["metadata"]:
-                        selected_paths["metadata"].append(path)
-    
-    return selected_paths
+        if subtree is None:
+            yield current_path
+        else:
+            yield from _leaf_paths(subtree, current_path)
+
+def _format_sample(value: Any, limit: int = 100) -> str:
+    """Render a sample value as a short line of text."""
+    text = value if isinstance(value, str) else json.dumps(value, ensure_ascii=False, default=str)
+    return text if len(text) <= limit else text[:limit] + "…"
+
+def render_field_table(tree: Dict[str, Any], sample_map: Dict[str, Any]) -> dict:
+    """Render every leaf path as a row of one data editor and return the selected paths.
+
+    Rows start out selected from the temporary selections saved when leaving the page.
+    """
+    paths = list(_leaf_paths(tree))
+    display_set = set(st.session_state.temp_selected_paths)
+    metadata_set = set(st.session_state.temp_metadata_paths)
+    table = pd.DataFrame({
+        "path": paths,
+        "sample": [_format_sample(sample_map.get(path)) for path in paths],
+        "select": [path in display_set or path in metadata_set for path in paths],
+        "type": ["Metadata" if path in metadata_set else "Display" for path in paths],
+    })
+
+    # One widget for the whole tree instead of a checkbox and radio per leaf
+    edited = st.data_editor(
+        table,
+        column_config={
+            "path": st.column_config.TextColumn("Field", disabled=True),
+            "sample": st.column_config.TextColumn("Sample", disabled=True),
+            "select": st.column_config.CheckboxColumn("Select"),
+            "type": st.column_config.SelectboxColumn("Type", options=["Display", "Metadata"], required=True),
+        },
+        hide_index=True,
+        use_container_width=True,
+        key="field_editor",
+    )
+
+    # Rows keep the tree's order, so the selections do too
+    chosen = edited.loc[edited["select"].astype(bool)]
+    return {
+        "fields": chosen.loc[chosen["type"] == "Display", "path"].tolist(),
+        "metadata": chosen.loc[chosen["type"] == "Metadata", "path"].tolist(),
+    }
+
+@st.fragment
+def _field_table_fragment(tree: Dict[str, Any], sample_map: Dict[str, Any]):
+    """Render the field table so edits inside it only rerun this fragment."""
+    st.session_state.tree_selection = render_field_table(tree, sample_map)
+
+# orjson turns integers beyond 64 bits into floats. Any integer with 19 or more
+# digits may be one, so input containing such a digit run goes to the stdlib.
+_LONG_DIGIT_RUN = b"0" * 19
+_DIGITS_TO_ZERO = bytes.maketrans(b"123456789", b"000000000")
+
+def _has_long_digit_run(raw: bytes, chunk_size: int = 1 << 24) -> bool:
+    """Return True if raw contains 19 or more consecutive ASCII digits."""
+    overlap = len(_LONG_DIGIT_RUN) - 1
+    # Translate in chunks (overlapping so runs across a boundary are found)
+    # to avoid copying the whole upload at once
+    for start in range(0, len(raw), chunk_size):
+        if _LONG_DIGIT_RUN in raw[start:start + chunk_size + overlap].translate(_DIGITS_TO_ZERO):
+            return True
+    return False
 
-def load_json_data(uploaded_file):
-    """Load data from either JSON or JSONL file and normalize into a consistent format."""
+def _parse_json(raw: bytes) -> Any:
+    """Parse JSON with orjson, falling back to the stdlib for input orjson rejects (e.g. NaN)
+    or could round (integers beyond 64 bits)."""
+    if orjson is None or _has_long_digit_run(raw):
+        return json.loads(raw)
+    try:
+        return orjson.loads(raw)
+    except orjson.JSONDecodeError:
+        return json.loads(raw)
+
+# Schema inference only samples the first records of an upload (see flatten_json)
+PREVIEW_RECORDS = 10
+
+# Per-upload caches are shared by every session, so keep only a few recent
+# uploads and drop idle ones; evicted entries are rebuilt from the raw bytes
+UPLOAD_CACHE_ENTRIES = 4
+UPLOAD_CACHE_TTL = 3600  # seconds
+
+def _parse_json_head(raw: bytes, max_records: int) -> Any:
+    """Stream-parse JSON with ijson, stopping once the top-level record list holds max_records items.
+
+    The record list is the root array or the root object's "data" array. Keys of the root
+    object that follow a truncated "data" array are not read.
+    """
+    builder = ijson.ObjectBuilder()
+    record_prefix = None
+    count = 0
+    for prefix, event, value in ijson.parse(io.BytesIO(raw), use_float=True):
+        builder.event(event, value)
+        if record_prefix is None:
+            if event == 'start_array' and prefix in ('', 'data'):
+                record_prefix = 'item' if prefix == '' else 'data.item'
+        elif prefix == record_prefix and event not in ('start_map', 'start_array', 'map_key'):
+            # A record ends with its closing bracket or is a single scalar
+            count += 1
+            if count >= max_records:
+                break
+    return builder.value
+
+def load_json_data_from_bytes(raw_bytes: bytes, file_extension: str, max_records: Optional[int] = None):
+    """Load raw JSON or JSONL bytes and normalize into a consistent format.
+
+    With `max_records`, parsing stops after that many records (the upload page's preview).
+    """
     try:
-        file_extension = uploaded_file.name.split(".")[-1].lower()
-        
         if file_extension == "jsonl":
-            # Read JSONL file line by line
-            content = uploaded_file.getvalue().decode("utf-8")
-            lines = [line.strip() for line in content.split("\n") if line.strip()]
-            
-            if not lines:
-                st.error("JSONL file is empty")
-                return None
-            
-            # Parse each line as JSON
+            # Stream JSONL lines straight from the bytes instead of decoding
+            # the whole file and holding a list of line strings
             records = []
-            for line in lines:
+            has_lines = False
+            for line in io.BytesIO(raw_bytes):
+                if not line.strip():
+                    continue
+                has_lines = True
                 try:
-                    record = json.loads(line)
-                    records.append(record)
+                    records.append(_parse_json(line))
                 except json.JSONDecodeError:
                     continue  # Skip invalid lines
+                if len(records) == max_records:
+                    break
+            
+            if not has_lines:
+                st.error("JSONL file is empty")
+                return None
             
             if not records:
                 st.error("No valid JSON records found in JSONL file")
@@ -254,7 +261,14 @@ def load_json_data(uploaded_file):
             return {"data": records}
             
         else:  # JSON file
-            data = json.load(uploaded_file)
+            data = None
+            if max_records is not None:
+                try:
+                    data = _parse_json_head(raw_bytes, max_records)
+                except ijson.JSONError:
+                    pass  # Input ijson rejects (e.g. NaN) gets the full parse below
+            if data is None:
+                data = _parse_json(raw_bytes)
             
             # Normalize the data structure
             if isinstance(data, list):
@@ -274,6 +288,59 @@ def load_json_data(uploaded_file):
         st.error(f"Error processing file: {str(e)}")
         return None
 
+@st.cache_resource(show_spinner=False, max_entries=UPLOAD_CACHE_ENTRIES, ttl=UPLOAD_CACHE_TTL)
+def _get_json_data(json_hash: str, _raw_bytes: bytes, file_extension: str):
+    """Parse an upload once and share the parsed data across reruns, keyed on its content hash."""
+    return load_json_data_from_bytes(_raw_bytes, file_extension)
+
+@st.cache_resource(show_spinner=False, max_entries=UPLOAD_CACHE_ENTRIES, ttl=UPLOAD_CACHE_TTL)
+def _get_json_preview(json_hash: str, _raw_bytes: bytes, file_extension: str):
+    """Parse only the first records of an upload for the upload page, keyed on its content hash."""
+    return load_json_data_from_bytes(_raw_bytes, file_extension, max_records=PREVIEW_RECORDS)
+
+def get_json_data():
+    """Return the parsed data of the current upload, or None if nothing was uploaded."""
+    json_hash = st.session_state.get("json_hash")
+    if json_hash is None:
+        return None
+    raw_bytes, file_extension = st.session_state.json_upload
+    return _get_json_data(json_hash, raw_bytes, file_extension)
+
+@st.cache_resource(show_spinner=False, max_entries=UPLOAD_CACHE_ENTRIES, ttl=UPLOAD_CACHE_TTL)
+def flatten_columnar(json_hash: str, _json_data: Any):
+    """Flatten every record into one object array per key path, cached on the upload's content hash.
+
+    Returns (columns, list_rows): `columns` maps a tuple of keys to the value at that path in
+    each record (None where missing), following dicts only. `list_rows` maps a path to the
+    record indexes where its value is a list, which readers must resolve with the list walk.
+    """
+    records = _json_data.get('data', [])
+    columns = {}
+    list_rows = defaultdict(list)
+    for i, record in enumerate(records):
+        stack = [((), record)]
+        while stack:
+            path, node = stack.pop()
+            if path:
+                column = columns.get(path)
+                if column is None:
+                    column = columns[path] = np.empty(len(records), dtype=object)
+                column[i] = node
+            if isinstance(node, dict):
+                for key, value in node.items():
+                    stack.append((path + (key,), value))
+            elif isinstance(node, list):
+                list_rows[path].append(i)
+    return columns, dict(list_rows)
+
+@st.cache_data(show_spinner=False, max_entries=UPLOAD_CACHE_ENTRIES, ttl=UPLOAD_CACHE_TTL)
+def build_tree(json_hash: str, _json_data: Any):
+    """Organize the paths of an upload into a tree, cached on the upload's content hash."""
+    # Get all possible paths (with a sample value each) and organize them into a tree
+    sample_map = {}
+    paths = flatten_json(_json_data, samples=sample_map)
+    return organize_paths(paths, _json_data), sample_map
+
 def validate_jsonl_consistency(records: List[dict]) -> bool:
     """Check if all records in JSONL have similar structure."""
     if not records:
@@ -298,11 +365,8 @@ def display_upload_page():
     # Add new session state for metadata columns
     if "metadata_columns" not in st.session_state:
         st.session_state.metadata_columns = []
-    if "json_data" not in st.session_state:
-        st.session_state.json_data = None
-    # Initialize tree toggles
-    if "tree_toggles" not in st.session_state:
-        st.session_state.tree_toggles = {}
+    if "json_hash" not in st.session_state:
+        st.session_state.json_hash = None
     # Initialize temporary states for selections
     if "temp_selected_paths" not in st.session_state:
         st.session_state.temp_selected_paths = set()
@@ -316,8 +380,14 @@ def display_upload_page():
 
     if uploaded_file is not None:
         try:
-            # Load and store JSON/JSONL data
-            json_data = load_json_data(uploaded_file)
+            # Keep only the content hash and raw bytes in session state; the parsed
+            # data is shared through the resource cache instead of copied per rerun
+            raw_bytes = uploaded_file.getvalue()
+            st.session_state.json_hash = hashlib.sha256(raw_bytes).hexdigest()
+            st.session_state.json_upload = (raw_bytes, uploaded_file.name.split(".")[-1].lower())
+            # The field tree only needs the first records; the full parse
+            # (get_json_data) is deferred to the pages that use every record
+            json_data = _get_json_preview(st.session_state.json_hash, *st.session_state.json_upload)
             
             if json_data is None:
                 return
@@ -327,22 +397,23 @@ def display_upload_page():
                 if not validate_jsonl_consistency(json_data.get('data', [])):
                     st.warning("Warning: Records in JSONL file have inconsistent structure. Some fields might not be available for all records.")
             
-            st.session_state.json_data = json_data
-
-            # Get all possible paths and organize them into a tree
-            paths = flatten_json(json_data)
-            tree = organize_paths(paths, json_data)
-            
-            
+            # Get the field tree for this upload (cached on the content hash)
+            tree, sample_map = build_tree(st.session_state.json_hash, json_data)
             
             st.markdown("### Select Fields to Label")
-            st.markdown("Expand sections and select the fields you want to include in your labeling task:")
+            st.markdown("Select the fields you want to include in your labeling task and whether each is displayed or kept as metadata:")
 
-            # Render the tree and get selected paths
-            selected_paths = render_tree(tree, json_data)
+            # Render the fields in their own fragment; the latest selection is kept in session state
+            _field_table_fragment(tree, sample_map)
+            selected_paths = st.session_state.tree_selection
 
             if st.button("Next"):
                 if selected_paths["fields"] or selected_paths["metadata"]:
+                    # The field tree only parsed the first records; make sure the
+                    # whole file parses before leaving (the loader shows the error)
+                    if get_json_data() is None:
+                        return
+
                     # Store display columns in selected_columns maintaining order
                     st.session_state.selected_columns = [
                         {
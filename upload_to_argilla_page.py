@@ -2,7 +2,15 @@ import streamlit as st
 import pandas as pd
 import argilla as rg
 import json
-from labeling_page import format_value  # If you have a custom format_value function
+import math
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from labeling_page import format_value, get_labeled_dataset  # If you have a custom format_value function
+from upload_page import flatten_columnar, get_json_data
+
+# Records are sent in chunks of this size, several chunks at a time
+RECORD_CHUNK_SIZE = 500
+UPLOAD_WORKERS = 4
 
 def convert_to_string(value):
     """Convert any value to a string representation suitable for Argilla"""
@@ -10,11 +18,87 @@ def convert_to_string(value):
         return format_value(value)  # Use your existing formatter
     return str(value) if value is not None else ""
 
-def get_value_from_path(data: dict, path: str):
-    """Extract value from nested JSON using a simple dot-notation path."""
+def field_strings(values: np.ndarray) -> np.ndarray:
+    """Convert a field column with convert_to_string, copying plain-text columns in bulk."""
+    if pd.api.types.infer_dtype(values, skipna=True) == "string":
+        # Strings pass through unchanged; only the missing cells need converting
+        strings = values.copy()
+        for i in np.flatnonzero(pd.isna(values)):
+            strings[i] = convert_to_string(values[i])
+        return strings
+    return np.array([convert_to_string(value) for value in values], dtype=object)
+
+def metadata_kind(values) -> str:
+    """Classify a metadata column as "integer", "float" or "terms" from its non-None values.
+
+    Integers must fit Argilla's 64-bit integer storage, and in a float column convert
+    to float exactly; columns with larger integers stay terms.
+    """
+    kind = None
+    fits_int64 = fits_float = True
+    for value in values:
+        if value is None:
+            continue
+        # Exact types, so booleans stay terms
+        if type(value) is int:
+            kind = kind or "integer"
+            fits_int64 = fits_int64 and -2**63 <= value < 2**63
+            fits_float = fits_float and abs(value) <= 2**53
+        elif type(value) is float and math.isfinite(value):
+            kind = "float"
+        else:
+            return "terms"
+    if kind == "integer" and fits_int64:
+        return "integer"
+    if kind == "float" and fits_float:
+        return "float"
+    return "terms"
+
+@st.cache_resource(show_spinner=False)
+def get_argilla_client(api_url: str, api_key: str):
+    """Connect to an Argilla server once and reuse the client across reruns."""
+    return rg.Argilla(api_url=api_url, api_key=api_key)
+
+def build_fields(field_cols: list) -> list:
+    """Create one Argilla text field per selected column."""
+    return [
+        rg.TextField(name=col, title=col, use_markdown=False)
+        for col in field_cols
+    ]
+
+def build_questions(questions: list) -> list:
+    """Create the Argilla questions for the user's Q&A definitions."""
+    label_questions = []
+    for question in questions:
+        q_title = question["question_title"]
+        q_type = question["question_type"]
+        q_labels = question["labels"]
+        q_desc = question["label_description"]
+
+        if q_type == "Label":
+            label_questions.append(
+                rg.LabelQuestion(name=q_title, labels=q_labels, description=q_desc)
+            )
+        elif q_type == "Multi-label":
+            label_questions.append(
+                rg.MultiLabelQuestion(name=q_title, labels=q_labels, description=q_desc)
+            )
+        elif q_type == "Rating":
+            label_questions.append(
+                rg.RatingQuestion(name=q_title, values=[1, 2, 3, 4, 5], description=q_desc)
+            )
+    return label_questions
+
+def chunked(items: list, size: int) -> list:
+    """Split items into consecutive lists of at most `size` items."""
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+def get_value_from_path(data: dict, path):
+    """Extract value from nested JSON using a simple dot-notation path or pre-split parts."""
     try:
         current = data
-        for part in path.split('.'):
+        parts = path.split('.') if isinstance(path, str) else path
+        for part in parts:
             if isinstance(current, dict):
                 current = current.get(part)
             elif isinstance(current, list) and current:
@@ -26,6 +110,18 @@ def get_value_from_path(data: dict, path: str):
     except (KeyError, IndexError, AttributeError):
         return None
 
+def get_metadata_column(path: str, records: list, stored_columns: dict, list_rows: dict):
+    """Return get_value_from_path(record, path) for every record, read from the upload's columnar store."""
+    parts = tuple(path.split('.'))
+    stored = stored_columns.get(parts)
+    column = stored.copy() if stored is not None else np.empty(len(records), dtype=object)
+    # Rows where the record or an intermediate value is a list take the
+    # first-item route through get_value_from_path
+    for depth in range(len(parts)):
+        for i in list_rows.get(parts[:depth], ()):
+            column[i] = get_value_from_path(records[i], parts)
+    return column
+
 def display_upload_to_argilla_page():
     st.title("Upload to Argilla")
     
@@ -36,7 +132,8 @@ def display_upload_to_argilla_page():
     metadata_columns = st.session_state.get("metadata_columns", [])
     questions = st.session_state.get("questions", [])
     # The original JSON data you want to pull metadata from
-    json_data = st.session_state.get("json_data", {}).get("data", [])
+    upload_data = get_json_data()
+    json_data = (upload_data or {}).get("data", [])
 
     if dataset.empty or not questions:
         st.warning("No labeled dataset or questions found. Please ensure labeling is completed before uploading.")
@@ -55,7 +152,7 @@ def display_upload_to_argilla_page():
         st.warning("No valid columns found. Please select at least one field or metadata column before uploading.")
     
     st.write("Labeled Dataset Preview:")
-    st.write(dataset.head())  # Show entire dataset for reference
+    st.write(get_labeled_dataset().head())  # Show entire dataset for reference
 
     guidelines = st.text_area("Write labeling guidelines:", value="")
     api_url = st.text_input("Argilla Server URL", value="https://dhruvil2004-my-argilla.hf.space/")
@@ -66,60 +163,68 @@ def display_upload_to_argilla_page():
 
     if st.button("Upload to Argilla"):
         try:
-            client = rg.Argilla(api_url=api_url, api_key=api_key)
+            client = get_argilla_client(api_url, api_key)
 
             # 2) Create Argilla fields for the labeling UI
-            fields = [
-                rg.TextField(name=col, title=col, use_markdown=False)
-                for col in field_cols
-            ]
+            fields = build_fields(field_cols)
 
-            # 3) Create metadata properties. We'll use TextMetadataProperty so any string is accepted.
+            # 3) Create metadata properties. Numeric columns become Integer/Float properties, which
+            #    need no option list; anything else uses TermsMetadataProperty with every value as an option.
             #    Each metadata_columns entry is assumed to look like {"text": "doc_type", "path": "doc_type"}.
             #    The "text" is what we'll use as Argilla's metadata name/title.
-            # First collect all possible values for each metadata field
-            metadata_values = {}
+            # Read every metadata path once, column by column, from the upload's
+            # columnar store instead of walking each record per path
+            stored_columns, list_rows = flatten_columnar(st.session_state.json_hash, upload_data) if upload_data else ({}, {})
+            metadata_arrays = {}
             for meta_def in metadata_columns:
-                unique_values = set()
-                for record in json_data:
-                    # Remove 'data.' from the path since we're already inside data array
-                    path = meta_def["path"].replace("data.", "")
-                    value = get_value_from_path(record, path)
+                # Remove the 'data.' prefix since we're already inside data array
+                path = meta_def["path"]
+                if path.startswith("data."):
+                    path = path[len("data."):]
+                metadata_arrays[meta_def["text"]] = get_metadata_column(path, json_data, stored_columns, list_rows)
+
+            metadata_kinds = {name: metadata_kind(values) for name, values in metadata_arrays.items()}
+
+            # Convert each record's metadata once, collecting the possible values
+            # for each terms field in the same pass. The options are the converted
+            # strings, so every record's value is one of them.
+            unique_values = {name: set() for name, kind in metadata_kinds.items() if kind == "terms"}
+            row_metadata = []
+            for idx in range(len(json_data)):
+                metadata_dict = {}
+                for name, values in metadata_arrays.items():
+                    value = values[idx]
                     if value is not None:
-                        unique_values.add(str(value))
-                metadata_values[meta_def["text"]] = sorted(list(unique_values))
+                        kind = metadata_kinds[name]
+                        if kind == "terms":
+                            text = convert_to_string(value)
+                            metadata_dict[name] = text
+                            unique_values[name].add(text)
+                        else:
+                            metadata_dict[name] = float(value) if kind == "float" else value
+                row_metadata.append(metadata_dict)
+            metadata_values = {name: sorted(values) for name, values in unique_values.items()}
 
             print("Collected metadata values:", metadata_values)  # Debug print
 
-            metadata_properties = [
-                rg.TermsMetadataProperty(
-                    name=meta_def["text"],  # Example: "doc_type"
-                    title=meta_def["text"],
-                    options=metadata_values[meta_def["text"]]  # Add the possible values
-                )
-                for meta_def in metadata_columns
-            ]
+            metadata_properties = []
+            for meta_def in metadata_columns:
+                name = meta_def["text"]  # Example: "doc_type"
+                if metadata_kinds[name] == "integer":
+                    metadata_properties.append(rg.IntegerMetadataProperty(name=name, title=name))
+                elif metadata_kinds[name] == "float":
+                    metadata_properties.append(rg.FloatMetadataProperty(name=name, title=name))
+                else:
+                    metadata_properties.append(
+                        rg.TermsMetadataProperty(
+                            name=name,
+                            title=name,
+                            options=metadata_values[name]  # Add the possible values
+                        )
+                    )
 
             # 4) Build label questions from your Q&A
-            label_questions = []
-            for question in questions:
-                q_title = question["question_title"]
-                q_type = question["question_type"]
-                q_labels = question["labels"]
-                q_desc = question["label_description"]
-
-                if q_type == "Label":
-                    label_questions.append(
-                        rg.LabelQuestion(name=q_title, labels=q_labels, description=q_desc)
-                    )
-                elif q_type == "Multi-label":
-                    label_questions.append(
-                        rg.MultiLabelQuestion(name=q_title, labels=q_labels, description=q_desc)
-                    )
-                elif q_type == "Rating":
-                    label_questions.append(
-                        rg.RatingQuestion(name=q_title, values=[1, 2, 3, 4, 5], description=q_desc)
-                    )
+            label_questions = build_questions(questions)
 
             # 5) Argilla dataset settings
             settings = rg.Settings(
@@ -130,23 +235,18 @@ def display_upload_to_argilla_page():
             )
 
             # 6) Build records. We'll match each row in the dataset with the corresponding JSON record by index.
+            #    Each column is converted to strings once, up front, rather than boxing
+            #    every row into a Series with iterrows().
+            field_arrays = [(col, field_strings(dataset[col].to_numpy())) for col in field_cols]
             records = []
-            for idx, row in dataset.iterrows():
+            for idx in range(len(dataset)):
                 fields_dict = {
-                    col: convert_to_string(row[col])
-                    for col in field_cols
+                    col: values[idx]
+                    for col, values in field_arrays
                 }
                 
-                metadata_dict = {}
-                if idx < len(json_data):
-                    for meta_def in metadata_columns:
-                        # Remove 'data.' from the path since we're already inside data array
-                        path = meta_def["path"].replace("data.", "")
-                        value = get_value_from_path(json_data[idx], path)
-                        if value is not None:
-                            metadata_dict[meta_def["text"]] = convert_to_string(value)
-
-        
+                metadata_dict = row_metadata[idx] if idx < len(row_metadata) else {}
+
                 record = rg.Record(
                     fields=fields_dict,
                     metadata=metadata_dict
@@ -157,12 +257,21 @@ def display_upload_to_argilla_page():
             dataset_for_argilla = rg.Dataset(
                 name=dataset_name,
                 workspace=workspace_name,
-                settings=settings
+                settings=settings,
+                client=client  # The cached client, not whichever one was created last
             )
             dataset_for_argilla.create()
 
-            # 8) Log records
-            dataset_for_argilla.records.log(records)
+            # 8) Log records in chunks on worker threads; the requests are I/O bound,
+            #    so their round trips overlap. Progress is reported from this thread.
+            chunks = chunked(records, RECORD_CHUNK_SIZE)
+            if chunks:
+                progress = st.progress(0.0, text="Uploading records...")
+                with ThreadPoolExecutor(max_workers=UPLOAD_WORKERS) as executor:
+                    futures = [executor.submit(dataset_for_argilla.records.log, chunk) for chunk in chunks]
+                    for done, future in enumerate(as_completed(futures), start=1):
+                        future.result()  # Re-raise a failed chunk for the handler below
+                        progress.progress(done / len(futures), text=f"Uploaded {done}/{len(futures)} batches")
 
             st.success("Data uploaded to Argilla successfully!")
 